@@ -1,75 +1,135 @@
 import asyncio
+import random
+import socket
 import time
 import logging
 from typing import Optional
 
 import aiohttp
+from cachetools import TTLCache
+
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # orjson is optional
+    import json
+
+    _json_loads = json.loads
+
+try:
+    import xxhash
+
+    _hash64 = xxhash.xxh3_64_intdigest
+except ImportError:  # xxhash is optional
+    _hash64 = hash
 
 log = logging.getLogger("context7.client")
 
 BASE_URL = "https://context7.com/api/v2"
 MAX_RETRIES = 3
+BASE_DELAY = 1.0
+MAX_DELAY = 30.0
+JITTER = 0.5
+
+# Connection pool tuning: keep idle connections around long enough to survive
+# the gaps between /ask invocations, and cache DNS so reconnects stay cheap.
+CONN_LIMIT = 64
+CONN_LIMIT_PER_HOST = 32
+KEEPALIVE_TIMEOUT = 75
+DNS_CACHE_TTL = 300
+
+# Keys that may hold the snippet list, in lookup order
+_SNIPPET_KEYS = ("results", "snippets", "context", "data", "items")
+
+# Upper bound on concurrent upstream requests per client
+MAX_CONCURRENCY = 16
+
+# get_context responses are cached per (library, normalized query, type)
+CACHE_SIZE = 512
+CACHE_TTL = 300
 
 
 class Context7Client:
     """Async wrapper around the Context7 REST API."""
 
-    def __init__(self, api_key: str = ""):
+    def __init__(
+        self,
+        api_key: str = "",
+        connector: Optional[aiohttp.BaseConnector] = None,
+        concurrency: int = MAX_CONCURRENCY,
+    ):
         self._api_key = api_key
+        self._header_dict = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._connector = connector
+        self._sem = asyncio.Semaphore(concurrency)
         self._session: Optional[aiohttp.ClientSession] = None
-
-    def _headers(self) -> dict:
-        h = {}
-        if self._api_key:
-            h["Authorization"] = f"Bearer {self._api_key}"
-        return h
+        self._cache: TTLCache = TTLCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+        self._inflight: dict[tuple, asyncio.Task] = {}
 
     async def _get_session(self) -> aiohttp.ClientSession:
         if self._session is None or self._session.closed:
             self._session = aiohttp.ClientSession(
-                headers=self._headers(),
+                connector=self._connector or _make_connector(),
+                # A caller-supplied connector outlives our session
+                connector_owner=self._connector is None,
+                headers=self._header_dict,
                 timeout=aiohttp.ClientTimeout(total=20),
             )
         return self._session
 
-    async def _request(self, path: str, params: dict) -> aiohttp.ClientResponse:
+    async def _request(self, path: str, params: dict) -> bytes:
+        """GET ``path`` with retries and return the response body.
+
+        The body is read while the concurrency slot is still held, so
+        downloads count against ``concurrency`` too.
+        """
         session = await self._get_session()
         url = f"{BASE_URL}{path}"
 
         for attempt in range(MAX_RETRIES):
-            t0 = time.perf_counter()
-            log.debug("GET %s params=%s (attempt %d)", url, params, attempt + 1)
-            resp = await session.get(url, params=params)
-            elapsed_ms = (time.perf_counter() - t0) * 1000
-
-            if resp.status == 429:
-                wait = 2 ** attempt
-                log.warning(
-                    "Rate-limited (429) on %s, retry in %ds (%.0fms)",
-                    path, wait, elapsed_ms,
-                )
-                await asyncio.sleep(wait)
-                continue
-
-            if resp.status >= 400:
-                body = await resp.text()
-                log.error(
-                    "HTTP %d on %s (%.0fms): %s",
-                    resp.status, path, elapsed_ms, body[:300],
-                )
-                resp.raise_for_status()
-
-            log.info("GET %s — %d (%.0fms)", path, resp.status, elapsed_ms)
-            return resp
-
-        raise RuntimeError("Context7 rate limit exceeded after retries")
+            last_attempt = attempt == MAX_RETRIES - 1
+            # Only the request itself holds a slot; backoff sleeps do not.
+            async with self._sem:
+                t0 = time.perf_counter()
+                log.debug("GET %s params=%s (attempt %d)", url, params, attempt + 1)
+                resp = await session.get(url, params=params)
+                elapsed_ms = (time.perf_counter() - t0) * 1000
+
+                # Out of retries: fall through so the error is logged and raised
+                if not last_attempt and (resp.status == 429 or resp.status >= 500):
+                    wait = _retry_delay(resp, attempt)
+                    log.warning(
+                        "HTTP %d on %s, retry in %.1fs (%.0fms)",
+                        resp.status, path, wait, elapsed_ms,
+                    )
+                    # Return the connection to the pool before sleeping
+                    resp.release()
+                else:
+                    if resp.status >= 400:
+                        if log.isEnabledFor(logging.ERROR):
+                            # Only decode a bounded prefix of (possibly huge) error pages
+                            raw = await resp.content.read(512)
+                            body = raw.decode("utf-8", "replace")[:300]
+                            log.error(
+                                "HTTP %d on %s (%.0fms): %s",
+                                resp.status, path, elapsed_ms, body,
+                            )
+                        resp.raise_for_status()
+
+                    body = await resp.read()
+                    elapsed_ms = (time.perf_counter() - t0) * 1000
+                    log.info("GET %s — %d (%.0fms)", path, resp.status, elapsed_ms)
+                    return body
+
+            await asyncio.sleep(wait)
 
     async def search_library(self, library_name: str, query: str) -> list[dict]:
-        resp = await self._request(
+        body = await self._request(
             "/libs/search",
             params={"libraryName": library_name, "query": query},
         )
-        data = await resp.json()
+        data = _json_loads(body)
         if isinstance(data, list):
             return data
         return data.get("results", data.get("libraries", []))
@@ -80,21 +140,123 @@ class Context7Client:
         query: str,
         response_type: str = "json",
     ) -> list[dict] | str:
-        resp = await self._request(
+        key = (library_id, query.strip().lower(), response_type)
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            log.debug("Cache hit for %s %r", library_id, query)
+            return _detach(cached)
+
+        # Single-flight: identical concurrent calls share one fetch. It runs
+        # in its own task and every caller awaits it through a shield, so
+        # cancelling any caller (the first one included) leaves it running
+        # for the others.
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(
+                self._fetch_and_cache(key, library_id, query, response_type)
+            )
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget_inflight(key, t))
+        else:
+            log.debug("Joining in-flight request for %s %r", library_id, query)
+        return _detach(await asyncio.shield(task))
+
+    async def _fetch_and_cache(
+        self,
+        key: tuple,
+        library_id: str,
+        query: str,
+        response_type: str,
+    ) -> list[dict] | str:
+        result = await self._fetch_context(library_id, query, response_type)
+        self._cache[key] = result
+        return result
+
+    def _forget_inflight(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark a failure retrieved so asyncio doesn't warn when every caller
+        # was cancelled before it finished
+        if not task.cancelled():
+            task.exception()
+
+    async def _fetch_context(
+        self,
+        library_id: str,
+        query: str,
+        response_type: str,
+    ) -> list[dict] | str:
+        body = await self._request(
             "/context",
             params={"libraryId": library_id, "query": query, "type": response_type},
         )
         if response_type == "txt":
-            return await resp.text()
+            return body.decode("utf-8", "replace")
 
-        data = await resp.json()
-        return _normalize_snippets(data)
+        data = _json_loads(body)
+        snippets = _normalize_snippets(data)
+        # Fingerprint once per fetch so cache hits reuse it when deduping
+        for s in snippets:
+            content = s.get("content")
+            if content:
+                s["_fingerprint"] = snippet_fingerprint(content)
+        return snippets
 
     async def close(self):
         if self._session and not self._session.closed:
             await self._session.close()
 
 
+def snippet_fingerprint(content: str) -> int:
+    """Hash the normalized first 200 chars of a snippet for near-duplicate checks.
+
+    Normalization happens on the encoded bytes (ASCII-only lowercasing and
+    whitespace stripping), which is enough for mostly-English docs and skips
+    two intermediate str copies.
+    """
+    return _hash64(content[:200].encode("utf-8", "ignore").lower().strip())
+
+
+def _detach(result: list[dict] | str) -> list[dict] | str:
+    """Shallow-copy list results so callers can't mutate the cached list."""
+    return list(result) if isinstance(result, list) else result
+
+
+def _make_connector() -> aiohttp.TCPConnector:
+    try:
+        # aiodns-backed, so lookups don't tie up executor threads
+        resolver = aiohttp.AsyncResolver()
+    except RuntimeError:  # aiodns is not installed
+        resolver = None
+    return aiohttp.TCPConnector(
+        limit=CONN_LIMIT,
+        limit_per_host=CONN_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        enable_cleanup_closed=True,
+        resolver=resolver,
+        # Skip AAAA lookups that only stall on IPv4-only hosts
+        family=socket.AF_INET,
+    )
+
+
+def _retry_delay(resp: aiohttp.ClientResponse, attempt: int) -> float:
+    """Seconds to wait before retrying, honoring ``Retry-After`` when present.
+
+    Capped at ``MAX_DELAY`` either way so a retry never outlives the
+    Discord interaction it is serving.
+    """
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            return min(MAX_DELAY, max(0.0, float(int(retry_after))))
+        except ValueError:
+            # HTTP-date form or garbage — fall back to our own backoff
+            pass
+    return min(MAX_DELAY, BASE_DELAY * (2 ** attempt)) * (1 + random.random() * JITTER)
+
+
 def _normalize_snippets(data) -> list[dict]:
     """Convert any Context7 response shape into a flat list of
     ``{title, content, source}`` dicts the bot can render."""
@@ -110,14 +272,16 @@ def _normalize_snippets(data) -> list[dict]:
     if "codeSnippets" in data and isinstance(data["codeSnippets"], list):
         return [_convert_code_snippet(s) for s in data["codeSnippets"]]
 
-    for key in ("results", "snippets", "context", "data", "items"):
-        if key in data and isinstance(data[key], list):
-            return data[key]
+    for key in _SNIPPET_KEYS:
+        v = data.get(key)
+        if isinstance(v, list):
+            return v
 
     if "content" in data or "title" in data:
         return [data]
 
-    log.warning("Unknown response shape, keys: %s", list(data.keys()))
+    if log.isEnabledFor(logging.WARNING):
+        log.warning("Unknown response shape, keys: %s", list(data.keys()))
     return []
 
 
@@ -1,47 +1,25 @@
 import os
+import sys
 import time
+import queue
+import atexit
 import asyncio
 import logging
-from logging.handlers import RotatingFileHandler
+from itertools import chain
+from logging.handlers import MemoryHandler, QueueHandler, QueueListener, RotatingFileHandler
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 from dotenv import load_dotenv
 
-from context7_client import Context7Client
-
-load_dotenv()
+from context7_client import Context7Client, snippet_fingerprint
 
 LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
-
 LOG_FMT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
 
-root_logger = logging.getLogger()
-root_logger.setLevel(logging.INFO)
-
-console = logging.StreamHandler()
-console.setFormatter(logging.Formatter(LOG_FMT))
-root_logger.addHandler(console)
-
-file_handler = RotatingFileHandler(
-    os.path.join(LOG_DIR, "bot.log"),
-    maxBytes=5 * 1024 * 1024,
-    backupCount=5,
-    encoding="utf-8",
-)
-file_handler.setFormatter(logging.Formatter(LOG_FMT))
-root_logger.addHandler(file_handler)
-
 log = logging.getLogger("bot")
 
-DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-if not DISCORD_TOKEN:
-    raise RuntimeError("DISCORD_TOKEN is not set in .env")
-
-CONTEXT7_API_KEY = os.getenv("CONTEXT7_API_KEY", "")
-
 DEFAULT_LIBRARY = "/websites/all-hands_dev"
 
 LIBRARY_CHOICES = [
@@ -58,13 +36,24 @@ ALL_LIBRARY_IDS = [
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-ctx7 = Context7Client(api_key=CONTEXT7_API_KEY)
+
+class OpenHandsBot(commands.Bot):
+    async def close(self):
+        await ctx7.close()
+        await super().close()
+
+
+bot = OpenHandsBot(command_prefix="!", intents=intents)
+# Created in main() once the API key has been loaded from .env
+ctx7: Context7Client
 
 
 @bot.event
 async def on_ready():
     log.info("Logged in as %s (ID: %s)", bot.user, bot.user.id)
+    # Create the HTTP session up front (idempotent across reconnects). No
+    # network I/O happens here; DNS and TLS still occur on the first /ask.
+    await ctx7._get_session()
     try:
         synced = await bot.tree.sync()
         log.info("Synced %d slash command(s)", len(synced))
@@ -72,6 +61,21 @@ async def on_ready():
         log.exception("Failed to sync slash commands")
 
 
+async def _fetch(lib_id: str, question: str) -> list[dict]:
+    """Fetch snippets for one library; failures are logged and yield ``[]``."""
+    try:
+        snippets = await ctx7.get_context(lib_id, question, response_type="json")
+        if isinstance(snippets, list):
+            log.info("  %s returned %d snippet(s)", lib_id, len(snippets))
+            for s in snippets:
+                s["_source_lib"] = lib_id
+            return snippets
+        log.warning("  %s returned unexpected type: %s", lib_id, type(snippets).__name__)
+    except Exception:
+        log.warning("  Failed to fetch from %s, skipping", lib_id, exc_info=True)
+    return []
+
+
 @bot.tree.command(name="ask", description="Ask a question about OpenHands")
 @app_commands.describe(
     question="Your question about OpenHands",
@@ -97,21 +101,8 @@ async def ask_command(
 
     t0 = time.perf_counter()
     try:
-        async def _fetch(lib_id: str) -> list[dict]:
-            try:
-                snippets = await ctx7.get_context(lib_id, question, response_type="json")
-                if isinstance(snippets, list):
-                    log.info("  %s returned %d snippet(s)", lib_id, len(snippets))
-                    for s in snippets:
-                        s["_source_lib"] = lib_id
-                    return snippets
-                log.warning("  %s returned unexpected type: %s", lib_id, type(snippets).__name__)
-            except Exception:
-                log.warning("  Failed to fetch from %s, skipping", lib_id, exc_info=True)
-            return []
-
-        results = await asyncio.gather(*[_fetch(lib) for lib in lib_ids])
-        all_snippets = [s for batch in results for s in batch]
+        results = await asyncio.gather(*(_fetch(lib, question) for lib in lib_ids))
+        all_snippets = list(chain.from_iterable(results))
 
         elapsed = time.perf_counter() - t0
 
@@ -163,12 +154,21 @@ async def help_command(interaction: discord.Interaction):
 
 def _dedup_snippets(snippets: list[dict]) -> list[dict]:
     """Remove near-duplicate snippets by comparing the first 200 chars of content."""
-    seen: set[str] = set()
+    seen: set[int] = set()
+    seen_empty = False
     unique: list[dict] = []
     for snip in snippets:
         content = snip.get("content", "")
-        # Extract the first meaningful chunk as a fingerprint
-        fingerprint = content[:200].strip().lower()
+        if not content:
+            # Nothing to hash; keep only the first empty snippet
+            if not seen_empty:
+                seen_empty = True
+                unique.append(snip)
+            continue
+        # Context7Client precomputes this; fall back for snippets from elsewhere
+        fingerprint = snip.get("_fingerprint")
+        if fingerprint is None:
+            fingerprint = snippet_fingerprint(content)
         if fingerprint in seen:
             continue
         seen.add(fingerprint)
@@ -182,32 +182,33 @@ def _safe_truncate(text: str, limit: int) -> str:
         return text
 
     truncated = text[: limit - 1]
+    last_fence = truncated.rfind("```")
+    if last_fence == -1:
+        # Plain text, no code blocks to keep balanced
+        return truncated + "…"
 
-    # Count opening/closing fences to see if we're inside a code block
-    fence_count = truncated.count("```")
-    if fence_count % 2 != 0:
+    # Count fences up to the last one to see if we're inside a code block
+    if truncated.count("```", 0, last_fence + 3) % 2 != 0:
         # We're inside an unclosed code block — cut before it opened
-        last_open = truncated.rfind("```")
-        truncated = truncated[:last_open].rstrip()
+        truncated = truncated[:last_fence].rstrip()
 
     return truncated + "…"
 
 
 def build_embed(query: str, snippets: list[dict], source_label: str = "Official Docs") -> discord.Embed:
-    embed = discord.Embed(
-        title="OpenHands",
-        description=f"**Q:** {query}",
-        color=0x57F287,
-    )
-
     deduped = _dedup_snippets(snippets)
     log.info("Deduped %d → %d unique snippet(s)", len(snippets), len(deduped))
 
+    fields: list[dict] = []
     total_len = 0
     max_embed_len = 5500
     max_field_len = 1024  # Discord hard limit per field
 
     for snip in deduped[:6]:
+        remaining = max_embed_len - total_len
+        if remaining <= 0:
+            break
+
         title = snip.get("title", "Untitled")
         content = snip.get("content", "")
         source = snip.get("source", "")
@@ -221,17 +222,98 @@ def build_embed(query: str, snippets: list[dict], source_label: str = "Official
         content = _safe_truncate(content, available)
 
         field_text = content + source_link
+        field_len = len(field_text)
 
         if not field_text.strip():
             continue
-        if total_len + len(field_text) > max_embed_len:
+        if field_len > remaining:
             break
-        total_len += len(field_text)
+        total_len += field_len
 
-        embed.add_field(name=title[:256], value=field_text, inline=False)
+        fields.append({"name": title[:256], "value": field_text, "inline": False})
 
+    embed = discord.Embed.from_dict({
+        "title": "OpenHands",
+        "description": f"**Q:** {query}",
+        "color": 0x57F287,
+        "fields": fields,
+    })
     embed.set_footer(text=f"Source: {source_label} · Powered by Context7")
     return embed
 
 
-bot.run(DISCORD_TOKEN)
+def _setup_logging():
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+
+    formatter = logging.Formatter(LOG_FMT)
+
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+
+    file_handler = RotatingFileHandler(
+        os.path.join(LOG_DIR, "bot.log"),
+        maxBytes=5 * 1024 * 1024,
+        backupCount=5,
+        encoding="utf-8",
+    )
+    file_handler.setFormatter(formatter)
+
+    # Batch routine file writes; warnings (retries, backoff) and errors flush
+    # immediately, and the small buffer bounds what a hard kill can lose
+    file_buffer = MemoryHandler(
+        capacity=64,
+        flushLevel=logging.WARNING,
+        target=file_handler,
+        flushOnClose=True,
+    )
+
+    # Console and file writes happen on the listener's thread, not the event loop
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root_logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, console, file_buffer, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+
+
+async def _run_bot(token: str):
+    async with bot:
+        await bot.start(token)
+
+
+def main():
+    global ctx7
+
+    load_dotenv()
+    _setup_logging()
+
+    discord_token = os.getenv("DISCORD_TOKEN")
+    if not discord_token:
+        raise RuntimeError("DISCORD_TOKEN is not set in .env")
+
+    ctx7 = Context7Client(api_key=os.getenv("CONTEXT7_API_KEY", ""))
+
+    try:
+        import uvloop
+    except ImportError:  # uvloop is optional and not available on Windows
+        uvloop = None
+
+    if uvloop is not None and sys.version_info >= (3, 11):
+        # Pass a loop factory instead of uvloop.install(): event loop
+        # policies are deprecated from Python 3.12 on.
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            try:
+                runner.run(_run_bot(discord_token))
+            except KeyboardInterrupt:
+                pass
+    else:
+        if uvloop is not None:
+            uvloop.install()
+        # Our root handlers already cover discord.py's loggers
+        bot.run(discord_token, log_handler=None)
+
+
+if __name__ == "__main__":
+    main()